@@ -1,8 +1,13 @@
+import itertools
 import os
 import sys
+import threading
 import time
-import requests
+import httpx
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,11 +28,44 @@ WEEKLY_DB_YEAR_PROP = "Year"            # Number property
 # Monthly Progress Database
 MONTHLY_DB_TITLE_PROP = "Month"         # Title property
 MONTHLY_DB_YEAR_PROP = "Year"           # Number property
+VALID_MONTHS = (
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+)
 
 # Retry / rate-limit settings
 MAX_RETRIES = 3
 INITIAL_BACKOFF_S = 1.0
 RATE_LIMIT_SLEEP_S = 0.35              # ~3 req/s Notion limit
+REQUEST_TIMEOUT_S = 30
+QUERY_PAGE_SIZE = 100                   # Notion's maximum page size
+
+# Only these properties are requested from each database query; the
+# rest of each page's properties are left out of the response.
+TASK_QUERY_PROPS = (
+    TASK_PROP_TITLE, TASK_PROP_YEAR, TASK_PROP_WEEK_NUMBER, TASK_PROP_MONTH,
+    TASK_PROP_WEEKLY_LINK, TASK_PROP_MONTHLY_LINK,
+)
+WEEKLY_QUERY_PROPS = (WEEKLY_DB_TITLE_PROP, WEEKLY_DB_YEAR_PROP)
+MONTHLY_QUERY_PROPS = (MONTHLY_DB_TITLE_PROP, MONTHLY_DB_YEAR_PROP)
+
+# Filter clauses shared by the backfill and incremental task queries: has a
+# Due Date and is missing Weekly Link OR Monthly Link. Built once; payloads
+# only reference them (they are serialized, never mutated), so no copying.
+UNLINKED_TASK_FILTERS = (
+    {"property": TASK_PROP_DUE_DATE, "date": {"is_not_empty": True}},
+    {
+        "or": [
+            {"property": TASK_PROP_WEEKLY_LINK, "relation": {"is_empty": True}},
+            {"property": TASK_PROP_MONTHLY_LINK, "relation": {"is_empty": True}},
+        ]
+    },
+)
+
+# Concurrency — tasks are processed in parallel, but requests are still
+# paced to RATE_LIMIT_SLEEP_S across all workers combined.
+MAX_WORKERS = 3
+MAX_IN_FLIGHT = 3                       # concurrent Notion requests, all threads
 
 # --- Secrets ---
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
@@ -45,105 +83,220 @@ HEADERS = {
     "Notion-Version": "2022-06-28"
 }
 
+# One shared HTTP/2 client for every Notion call: the TCP/TLS handshake to
+# api.notion.com is paid once per run, and concurrent requests from the
+# worker threads are multiplexed over the same connection.
+# Retries stay in _request_with_retry, which honours Retry-After.
+CLIENT = httpx.Client(
+    http2=True,
+    headers=HEADERS,
+    timeout=REQUEST_TIMEOUT_S,
+    limits=httpx.Limits(max_keepalive_connections=8),
+)
+
+_rate_lock = threading.Lock()
+_next_request_at = 0.0
+_in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+_log_state = threading.local()
+_print_lock = threading.Lock()
+
+# database_id -> {property name: property id}, or None if unreadable.
+_property_id_cache = {}
+
+_page_locks = {}
+_page_locks_guard = threading.Lock()
+
+# Runs a task's Weekly and Monthly lookups side by side. Kept separate from
+# the task pool so a task waiting on its lookups can never starve them.
+_lookup_executor = ThreadPoolExecutor(max_workers=2 * MAX_WORKERS)
+
+# Page IDs already resolved this run, keyed by (db_id, title, year).
+# Many tasks share a week/month, so each key only has to be looked up
+# (or created) once.
+_page_cache = {}
+
+# (db_id, year) pairs whose pages were all loaded by prefetch_progress_pages.
+# A cache miss for one of these means the page does not exist yet.
+_prefetched = set()
+
 # ──────────────────────────────────────────────
 # Helpers
 # ──────────────────────────────────────────────
 
+def _log(message=""):
+    """Print a message, or buffer it while a worker is processing a task.
+
+    Buffering keeps each task's lines together instead of interleaving
+    them with the output of other workers.
+    """
+    buffer = getattr(_log_state, "buffer", None)
+    if buffer is not None:
+        buffer.append(message)
+        return
+    with _print_lock:
+        print(message)
+
+
+def _wait_for_rate_limit():
+    """Block until the next request slot, shared by all worker threads."""
+    global _next_request_at
+    with _rate_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + RATE_LIMIT_SLEEP_S
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _page_lock(*key):
+    """Return the lock guarding find-or-create of one Weekly/Monthly page.
+
+    Without it, two workers handling tasks from the same week could both
+    miss the page and create a duplicate.
+    """
+    with _page_locks_guard:
+        return _page_locks.setdefault(key, threading.Lock())
+
+
 def _request_with_retry(method, url, **kwargs):
     """Make an HTTP request with retries + exponential backoff.
     
-    Retries on 429 (rate-limit) and 5xx errors.
-    Returns the Response object, or None on total failure.
+    Retries on 429 (rate-limit) and 5xx errors. A `json` body is encoded
+    with orjson. Returns the Response object, or None on total failure.
     """
+    if "json" in kwargs:
+        kwargs["content"] = orjson.dumps(kwargs.pop("json"))
+
     backoff = INITIAL_BACKOFF_S
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            time.sleep(RATE_LIMIT_SLEEP_S)  # rate-limit pacing
-            resp = requests.request(method, url, headers=HEADERS, **kwargs)
+            _wait_for_rate_limit()
+            with _in_flight:
+                resp = CLIENT.request(method, url, **kwargs)
 
             if resp.status_code == 429:
                 retry_after = int(resp.headers.get("Retry-After", backoff))
-                print(f"  ⏳ Rate-limited. Waiting {retry_after}s (attempt {attempt}/{MAX_RETRIES})")
+                _log(f"  ⏳ Rate-limited. Waiting {retry_after}s (attempt {attempt}/{MAX_RETRIES})")
                 time.sleep(retry_after)
                 backoff *= 2
                 continue
 
             if resp.status_code >= 500:
-                print(f"  ⚠️ Server error {resp.status_code}. Retrying in {backoff}s (attempt {attempt}/{MAX_RETRIES})")
+                _log(f"  ⚠️ Server error {resp.status_code}. Retrying in {backoff}s (attempt {attempt}/{MAX_RETRIES})")
                 time.sleep(backoff)
                 backoff *= 2
                 continue
 
             return resp  # success or client error we shouldn't retry
-        except requests.exceptions.RequestException as e:
-            print(f"  ⚠️ Network error: {e}. Retrying in {backoff}s (attempt {attempt}/{MAX_RETRIES})")
+        except httpx.RequestError as e:
+            _log(f"  ⚠️ Network error: {e}. Retrying in {backoff}s (attempt {attempt}/{MAX_RETRIES})")
             time.sleep(backoff)
             backoff *= 2
 
-    print("  ❌ All retries exhausted.")
+    _log("  ❌ All retries exhausted.")
     return None
 
 
-def _paginated_query(database_id, payload):
-    """Query a Notion database with automatic pagination.
-    
-    Returns the full list of result pages.
+def _property_ids(database_id, names):
+    """Look up property IDs by name for use with filter_properties.
+
+    The database schema is fetched once per run. Returns None if the
+    schema can't be read or a name is missing, in which case the caller
+    should fetch every property.
     """
-    all_results = []
-    has_more = True
-    start_cursor = None
+    if database_id not in _property_id_cache:
+        resp = _request_with_retry("GET", f"https://api.notion.com/v1/databases/{database_id}")
+        if resp is None or resp.status_code != 200:
+            error_text = resp.text if resp else "No response"
+            _log(f"  ⚠️ Could not read database schema, fetching all properties: {error_text}")
+            _property_id_cache[database_id] = None
+        else:
+            _property_id_cache[database_id] = {
+                name: unquote(prop["id"])
+                for name, prop in orjson.loads(resp.content).get("properties", {}).items()
+            }
+
+    schema = _property_id_cache[database_id]
+    if schema is None or any(name not in schema for name in names):
+        return None
+    return [schema[name] for name in names]
 
-    while has_more:
-        body = dict(payload)
-        if start_cursor:
-            body["start_cursor"] = start_cursor
 
+def _iter_query(database_id, payload, properties=None):
+    """Query a Notion database, yielding each batch of results as it arrives.
+
+    Follows has_more/next_cursor until the last page. If `properties`
+    (names) is given, only those properties are returned for each page.
+    If a request fails, None is yielded as the final item.
+    """
+    params = None
+    if properties:
+        property_ids = _property_ids(database_id, properties)
+        if property_ids:
+            params = [("filter_properties", pid) for pid in property_ids]
+
+    body = dict(payload, page_size=QUERY_PAGE_SIZE)
+    while True:
         resp = _request_with_retry("POST",
                                    f"https://api.notion.com/v1/databases/{database_id}/query",
+                                   params=params,
                                    json=body)
         if resp is None or resp.status_code != 200:
             error_text = resp.text if resp else "No response"
-            print(f"  ❌ Query failed: {error_text}")
-            break
+            _log(f"  ❌ Query failed: {error_text}")
+            yield None
+            return
 
-        data = resp.json()
-        all_results.extend(data.get("results", []))
-        has_more = data.get("has_more", False)
-        start_cursor = data.get("next_cursor")
+        data = orjson.loads(resp.content)
+        yield data.get("results", [])
+        if not data.get("has_more") or not data.get("next_cursor"):
+            return
+        body["start_cursor"] = data["next_cursor"]
 
+
+def _paginated_query(database_id, payload, allow_partial=True, properties=None):
+    """Query a Notion database with automatic pagination.
+    
+    Returns the full list of result pages. If a page request fails, the
+    results gathered so far are returned, or None when allow_partial is
+    False.
+    """
+    all_results = []
+    for batch in _iter_query(database_id, payload, properties):
+        if batch is None:
+            return all_results if allow_partial else None
+        all_results.extend(batch)
     return all_results
 
 
+def _iter_tasks(database_id, payload, sweep):
+    """Yield task pages one by one as each query page arrives, then log the count."""
+    count = 0
+    for batch in _iter_query(database_id, payload, TASK_QUERY_PROPS):
+        if batch is None:
+            break
+        count += len(batch)
+        yield from batch
+    _log(f"   Found {count} task(s) in {sweep} sweep.")
+
+
 # ──────────────────────────────────────────────
 # Core Functions
 # ──────────────────────────────────────────────
 
 def get_backfill_tasks():
-    """Get ALL tasks that have a Due Date but are missing Weekly Link OR Monthly Link.
+    """Yield ALL tasks that have a Due Date but are missing Weekly Link OR Monthly Link.
     
     No time filter — this catches every historical gap.
     """
-    payload = {
-        "filter": {
-            "and": [
-                {"property": TASK_PROP_DUE_DATE, "date": {"is_not_empty": True}},
-                {
-                    "or": [
-                        {"property": TASK_PROP_WEEKLY_LINK, "relation": {"is_empty": True}},
-                        {"property": TASK_PROP_MONTHLY_LINK, "relation": {"is_empty": True}},
-                    ]
-                }
-            ]
-        }
-    }
-    print("🔎 [Backfill] Querying for ALL unlinked tasks...")
-    results = _paginated_query(TASKS_DB_ID, payload)
-    print(f"   Found {len(results)} task(s) in backfill sweep.")
-    return results
+    payload = {"filter": {"and": list(UNLINKED_TASK_FILTERS)}}
+    _log("🔎 [Backfill] Querying for ALL unlinked tasks...")
+    yield from _iter_tasks(TASKS_DB_ID, payload, "backfill")
 
 
 def get_incremental_tasks():
-    """Get recently-edited tasks that are missing Weekly Link OR Monthly Link.
+    """Yield recently-edited tasks that are missing Weekly Link OR Monthly Link.
     
     Uses a 65-minute lookback window (matches the hourly cron + margin).
     """
@@ -151,63 +304,45 @@ def get_incremental_tasks():
     payload = {
         "filter": {
             "and": [
-                {"property": TASK_PROP_DUE_DATE, "date": {"is_not_empty": True}},
-                {
-                    "or": [
-                        {"property": TASK_PROP_WEEKLY_LINK, "relation": {"is_empty": True}},
-                        {"property": TASK_PROP_MONTHLY_LINK, "relation": {"is_empty": True}},
-                    ]
-                },
+                *UNLINKED_TASK_FILTERS,
                 {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": cut_off_time}}
             ]
         }
     }
-    print("🔎 [Incremental] Querying for recently-edited unlinked tasks...")
-    results = _paginated_query(TASKS_DB_ID, payload)
-    print(f"   Found {len(results)} task(s) in incremental sweep.")
-    return results
+    _log("🔎 [Incremental] Querying for recently-edited unlinked tasks...")
+    yield from _iter_tasks(TASKS_DB_ID, payload, "incremental")
 
 
-def merge_tasks(backfill, incremental):
-    """Merge two task lists, de-duplicating by task ID."""
-    seen = {}
-    for task in backfill + incremental:
+def iter_unique_tasks():
+    """Yield backfill then incremental tasks, de-duplicated by task ID."""
+    seen = set()
+    for task in itertools.chain(get_backfill_tasks(), get_incremental_tasks()):
         tid = task.get("id")
         if tid and tid not in seen:
-            seen[tid] = task
-    return list(seen.values())
+            seen.add(tid)
+            yield task
 
 
 def extract_task_properties(task_properties):
     """Extract year, week, month from task formula properties."""
     try:
-        # Extract Year (number)
-        year_prop = task_properties.get(TASK_PROP_YEAR, {}).get("formula", {})
-        if year_prop.get("type") == "number":
-            year = year_prop.get("number")
-            if year is None:
-                return None, None, None
-            year = int(year)
-        else:
-            return None, None, None
-
-        # Extract Week Number (could be text "41" or number 41)
-        week_prop = task_properties.get(TASK_PROP_WEEK_NUMBER, {}).get("formula", {})
-        week_value = week_prop.get("string") or week_prop.get("number")
-        if not week_value:
-            return None, None, None
-        week_text = str(week_value)
-
-        # Extract Month (text like "October")
-        month_prop = task_properties.get(TASK_PROP_MONTH, {}).get("formula", {})
-        month_text = month_prop.get("string")
-        if not month_text:
-            return None, None, None
-
-        return year, week_text, month_text
+        year_formula = task_properties[TASK_PROP_YEAR]["formula"]
+        week_formula = task_properties[TASK_PROP_WEEK_NUMBER]["formula"]
+        month_formula = task_properties[TASK_PROP_MONTH]["formula"]
+    except (KeyError, TypeError):
+        return None, None, None  # property missing or not a formula
+
+    # Year (number), Week Number (text "41" or number 41), Month (text like "October")
+    year = year_formula.get("number") if year_formula.get("type") == "number" else None
+    week_value = week_formula.get("string") or week_formula.get("number")
+    month_text = month_formula.get("string")
+    if year is None or not week_value or not month_text:
+        return None, None, None
 
-    except Exception as e:
-        print(f"  ⚠️ Error extracting properties: {e}")
+    try:
+        return int(year), str(week_value), month_text
+    except (TypeError, ValueError, OverflowError) as e:
+        _log(f"  ⚠️ Error extracting properties: {e}")
         return None, None, None
 
 
@@ -218,15 +353,15 @@ def _has_existing_relation(task_properties, relation_prop_name):
     return len(rel_list) > 0
 
 
-def _create_weekly_page(week_text, year):
-    """Create a new Weekly Progress page with the given week number and year."""
+def _create_page(db_id, title_prop, title_value, year_prop, year, label):
+    """Create a new Weekly/Monthly Progress page with the given title and year."""
     payload = {
-        "parent": {"database_id": WEEKLY_DB_ID},
+        "parent": {"database_id": db_id},
         "properties": {
-            WEEKLY_DB_TITLE_PROP: {
-                "title": [{"text": {"content": week_text}}]
+            title_prop: {
+                "title": [{"text": {"content": title_value}}]
             },
-            WEEKLY_DB_YEAR_PROP: {
+            year_prop: {
                 "number": year
             }
         }
@@ -236,123 +371,124 @@ def _create_weekly_page(week_text, year):
                                json=payload)
     if resp is None or resp.status_code != 200:
         error_text = resp.text if resp else "No response"
-        print(f"  ❌ Failed to create Weekly page: {error_text}")
+        _log(f"  ❌ Failed to create page for {label} ({year}): {error_text}")
         return None
 
-    page_id = resp.json().get("id")
-    print(f"  🆕 Created: Week {week_text} ({year})")
+    page_id = orjson.loads(resp.content).get("id")
+    _log(f"  🆕 Created: {label} ({year})")
     return page_id
 
 
-def _create_monthly_page(month_text, year):
-    """Create a new Monthly Progress page with the given month name and year."""
-    payload = {
-        "parent": {"database_id": MONTHLY_DB_ID},
-        "properties": {
-            MONTHLY_DB_TITLE_PROP: {
-                "title": [{"text": {"content": month_text}}]
-            },
-            MONTHLY_DB_YEAR_PROP: {
-                "number": year
-            }
-        }
-    }
-    resp = _request_with_retry("POST",
-                               "https://api.notion.com/v1/pages",
-                               json=payload)
-    if resp is None or resp.status_code != 200:
-        error_text = resp.text if resp else "No response"
-        print(f"  ❌ Failed to create Monthly page: {error_text}")
-        return None
+def _index_progress_pages(db_id, pages, title_prop, year_prop):
+    """Map (db_id, title_text, year) -> page_id for Weekly/Monthly database pages."""
+    index = {}
+    for page in pages:
+        props = page.get("properties", {})
+        title = "".join(t.get("plain_text", "") for t in props.get(title_prop, {}).get("title", []))
+        year = props.get(year_prop, {}).get("number")
+        if title and year is not None:
+            index.setdefault((db_id, title, int(year)), page["id"])
+    return index
 
-    page_id = resp.json().get("id")
-    print(f"  🆕 Created: {month_text} {year}")
-    return page_id
 
+def _years_filter(year_prop, years):
+    """Query payload matching pages whose `year_prop` is any of `years`."""
+    return {"filter": {"or": [{"property": year_prop, "number": {"equals": y}} for y in years]}}
 
-def find_weekly_page(week_text, year, auto_create=True):
-    """Find Weekly Progress page by week number AND year.
-    
-    If not found and auto_create is True, creates the page automatically.
-    Returns (page_id, was_created) tuple.
+
+def prefetch_progress_pages(years):
+    """Load every Weekly and Monthly page for the given years up front.
+
+    Two paginated queries replace one filtered query per task, and the
+    results seed the page cache used by find_page.
     """
-    payload = {
-        "filter": {
-            "and": [
-                {"property": WEEKLY_DB_TITLE_PROP, "title": {"equals": week_text}},
-                {"property": WEEKLY_DB_YEAR_PROP, "number": {"equals": year}},
-            ]
-        }
-    }
-    resp = _request_with_retry("POST",
-                               f"https://api.notion.com/v1/databases/{WEEKLY_DB_ID}/query",
-                               json=payload)
-    if resp is None or resp.status_code != 200:
-        error_text = resp.text if resp else "No response"
-        print(f"  ⚠️ Error searching weekly: {error_text}")
-        return None, False
+    years = sorted(years)
+    if not years:
+        return
 
-    results = resp.json().get("results", [])
-    if results:
-        print(f"  ✅ Found: Week {week_text} ({year})")
-        return results[0]["id"], False
+    _log(f"🔎 [Prefetch] Loading Weekly/Monthly pages for {', '.join(map(str, years))}...")
+    weekly_pages = _paginated_query(WEEKLY_DB_ID, _years_filter(WEEKLY_DB_YEAR_PROP, years),
+                                    allow_partial=False, properties=WEEKLY_QUERY_PROPS)
+    monthly_pages = _paginated_query(MONTHLY_DB_ID, _years_filter(MONTHLY_DB_YEAR_PROP, years),
+                                     allow_partial=False, properties=MONTHLY_QUERY_PROPS)
 
-    # Page not found — auto-create if enabled
-    if auto_create:
-        print(f"  ⚠️ Not found: Week {week_text}, Year {year} → Auto-creating...")
-        page_id = _create_weekly_page(week_text, year)
-        return page_id, (page_id is not None)
-    else:
-        print(f"  ⚠️ Not found: Week {week_text}, Year {year}")
-        return None, False
+    if weekly_pages is None or monthly_pages is None:
+        _log("   ⚠️ Prefetch incomplete — falling back to per-task lookups.")
+        return
 
+    _page_cache.update(_index_progress_pages(WEEKLY_DB_ID, weekly_pages, WEEKLY_DB_TITLE_PROP, WEEKLY_DB_YEAR_PROP))
+    _page_cache.update(_index_progress_pages(MONTHLY_DB_ID, monthly_pages, MONTHLY_DB_TITLE_PROP, MONTHLY_DB_YEAR_PROP))
+    _prefetched.update((db_id, y) for db_id in (WEEKLY_DB_ID, MONTHLY_DB_ID) for y in years)
+    _log(f"   Found {len(weekly_pages)} weekly and {len(monthly_pages)} monthly page(s).")
+
+
+def find_page(db_id, title_prop, title_value, year_prop, year, label, auto_create=True):
+    """Find a Weekly/Monthly Progress page by title AND year.
 
-def find_monthly_page(month_text, year, auto_create=True):
-    """Find Monthly Progress page by month name AND year.
-    
     If not found and auto_create is True, creates the page automatically.
+    `label` is only used in log output (e.g. "Week 41", "October").
     Returns (page_id, was_created) tuple.
     """
-    # Validate month name before searching
-    valid_months = [
-        "January", "February", "March", "April", "May", "June",
-        "July", "August", "September", "October", "November", "December"
-    ]
-    if month_text not in valid_months:
-        print(f"  ⚠️ Invalid month name: '{month_text}' — skipping")
-        return None, False
-
-    payload = {
-        "filter": {
-            "and": [
-                {"property": MONTHLY_DB_TITLE_PROP, "title": {"equals": month_text}},
-                {"property": MONTHLY_DB_YEAR_PROP, "number": {"equals": year}},
-            ]
+    cache_key = (db_id, title_value, year)
+    cached_id = _page_cache.get(cache_key)
+    if cached_id:
+        _log(f"  ✅ Found: {label} ({year})")
+        return cached_id, False
+
+    if (db_id, year) in _prefetched:
+        results = []  # prefetch already saw every page for this year
+    else:
+        payload = {
+            "filter": {
+                "and": [
+                    {"property": title_prop, "title": {"equals": title_value}},
+                    {"property": year_prop, "number": {"equals": year}},
+                ]
+            }
         }
-    }
-    resp = _request_with_retry("POST",
-                               f"https://api.notion.com/v1/databases/{MONTHLY_DB_ID}/query",
-                               json=payload)
-    if resp is None or resp.status_code != 200:
-        error_text = resp.text if resp else "No response"
-        print(f"  ⚠️ Error searching monthly: {error_text}")
-        return None, False
+        resp = _request_with_retry("POST",
+                                   f"https://api.notion.com/v1/databases/{db_id}/query",
+                                   json=payload)
+        if resp is None or resp.status_code != 200:
+            error_text = resp.text if resp else "No response"
+            _log(f"  ⚠️ Error searching for {label} ({year}): {error_text}")
+            return None, False
+
+        results = orjson.loads(resp.content).get("results", [])
 
-    results = resp.json().get("results", [])
     if results:
-        print(f"  ✅ Found: {month_text} {year}")
+        _log(f"  ✅ Found: {label} ({year})")
+        _page_cache[cache_key] = results[0]["id"]
         return results[0]["id"], False
 
     # Page not found — auto-create if enabled
     if auto_create:
-        print(f"  ⚠️ Not found: {month_text}, Year {year} → Auto-creating...")
-        page_id = _create_monthly_page(month_text, year)
+        _log(f"  ⚠️ Not found: {label}, Year {year} → Auto-creating...")
+        page_id = _create_page(db_id, title_prop, title_value, year_prop, year, label)
+        if page_id:
+            _page_cache[cache_key] = page_id
         return page_id, (page_id is not None)
     else:
-        print(f"  ⚠️ Not found: {month_text}, Year {year}")
+        _log(f"  ⚠️ Not found: {label}, Year {year}")
         return None, False
 
 
+def find_weekly_page(week_text, year, auto_create=True):
+    """Find (or auto-create) the Weekly Progress page for a week number AND year."""
+    return find_page(WEEKLY_DB_ID, WEEKLY_DB_TITLE_PROP, week_text, WEEKLY_DB_YEAR_PROP, year,
+                     f"Week {week_text}", auto_create)
+
+
+def find_monthly_page(month_text, year, auto_create=True):
+    """Find (or auto-create) the Monthly Progress page for a month name AND year."""
+    if month_text not in VALID_MONTHS:
+        _log(f"  ⚠️ Invalid month name: '{month_text}' — skipping")
+        return None, False
+
+    return find_page(MONTHLY_DB_ID, MONTHLY_DB_TITLE_PROP, month_text, MONTHLY_DB_YEAR_PROP, year,
+                     month_text, auto_create)
+
+
 def update_task_relations(task_id, weekly_page_id, monthly_page_id):
     """Update task relation properties. Returns True on success."""
     properties_to_update = {}
@@ -369,10 +505,10 @@ def update_task_relations(task_id, weekly_page_id, monthly_page_id):
                                json={"properties": properties_to_update})
     if resp is None or resp.status_code != 200:
         error_text = resp.text if resp else "No response"
-        print(f"  ❌ Failed to update: {error_text}")
+        _log(f"  ❌ Failed to update: {error_text}")
         return False
 
-    print(f"  ✅ Successfully linked task")
+    _log(f"  ✅ Successfully linked task")
     return True
 
 
@@ -380,95 +516,148 @@ def update_task_relations(task_id, weekly_page_id, monthly_page_id):
 # Main
 # ──────────────────────────────────────────────
 
-def main():
-    """Two-phase sync: backfill all gaps, then incremental recent tasks."""
-    # Phase 1 — Backfill
-    backfill_tasks = get_backfill_tasks()
+def _find_locked(kind, find, title_value, year):
+    """Run a page lookup under its page lock on a helper thread.
 
-    # Phase 2 — Incremental (recent edits)
-    incremental_tasks = get_incremental_tasks()
+    Returns (result, log_lines) so the caller can replay the lines into
+    its own task log in a stable order.
+    """
+    _log_state.buffer = []
+    try:
+        with _page_lock(kind, title_value, year):
+            result = find(title_value, year)
+    finally:
+        lines, _log_state.buffer = _log_state.buffer, None
+    return result, lines
 
-    # Merge & de-duplicate
-    tasks_to_process = merge_tasks(backfill_tasks, incremental_tasks)
-    print(f"\n📋 Total unique tasks to process: {len(tasks_to_process)}")
-    print(f"   (Backfill: {len(backfill_tasks)}, Incremental: {len(incremental_tasks)})")
-    print(f"🗓️  Using Year-aware matching\n")
 
-    if not tasks_to_process:
-        print("✅ No tasks to process. Everything is in sync!")
-        return
+def _collect_lookup(future):
+    """Wait for a _find_locked future; returns (page_id, was_created)."""
+    if future is None:
+        return None, False
+    result, lines = future.result()
+    for line in lines:
+        _log(line)
+    return result
 
-    # Counters
-    linked = 0
-    skipped = 0
-    failed = 0
-    created_weekly = 0
-    created_monthly = 0
 
-    for task in tasks_to_process:
-        task_id = task.get("id")
-        properties = task.get("properties", {})
+def process_task(task):
+    """Link one task to its Weekly and Monthly pages.
 
-        try:
-            # Get title
-            title_list = properties.get(TASK_PROP_TITLE, {}).get("title", [])
-            task_title = title_list[0]["plain_text"] if title_list else "Untitled Task"
+    Returns (outcome, weekly_was_created, monthly_was_created) where
+    outcome is "linked", "skipped" or "failed".
+    """
+    task_id = task.get("id")
+    properties = task.get("properties", {})
 
-            # Get year, week, month
-            year, week_text, month_text = extract_task_properties(properties)
+    try:
+        # Get title
+        title_list = properties.get(TASK_PROP_TITLE, {}).get("title", [])
+        task_title = title_list[0]["plain_text"] if title_list else "Untitled Task"
 
-            if not all([year, week_text, month_text]):
-                print(f"⏩ Skipping '{task_title}' — Missing Year/Week/Month properties")
-                skipped += 1
-                continue
+        # Get year, week, month
+        year, week_text, month_text = extract_task_properties(properties)
 
-        except Exception as e:
-            print(f"⏩ Skipping task — Error reading properties: {e}")
-            skipped += 1
-            continue
-
-        print(f"\n📋 Processing: '{task_title}'")
-        print(f"   📅 Year: {year}, Week: {week_text}, Month: {month_text}")
-
-        # Check which relations are already set
-        needs_weekly = not _has_existing_relation(properties, TASK_PROP_WEEKLY_LINK)
-        needs_monthly = not _has_existing_relation(properties, TASK_PROP_MONTHLY_LINK)
-
-        if not needs_weekly and not needs_monthly:
-            print(f"  ⏩ Already fully linked, skipping")
-            skipped += 1
-            continue
-
-        # Find pages only for the missing relations (auto-creates if not found)
-        weekly_page_id, weekly_was_created = find_weekly_page(week_text, year) if needs_weekly else (None, False)
-        monthly_page_id, monthly_was_created = find_monthly_page(month_text, year) if needs_monthly else (None, False)
-
-        if weekly_was_created:
-            created_weekly += 1
-        if monthly_was_created:
-            created_monthly += 1
-
-        # If we couldn't find or create the target pages, skip
-        if needs_weekly and not weekly_page_id:
-            print(f"  ⚠️ Cannot link weekly — page not found or created")
-        if needs_monthly and not monthly_page_id:
-            print(f"  ⚠️ Cannot link monthly — page not found or created")
-
-        if not weekly_page_id and not monthly_page_id:
-            print(f"  ⏩ No matching pages found, skipping")
-            skipped += 1
-            continue
-
-        # Update task
-        success = update_task_relations(task_id, weekly_page_id, monthly_page_id)
-        if success:
-            linked += 1
-        else:
-            failed += 1
+        if not all([year, week_text, month_text]):
+            _log(f"⏩ Skipping '{task_title}' — Missing Year/Week/Month properties")
+            return "skipped", False, False
+
+    except Exception as e:
+        _log(f"⏩ Skipping task — Error reading properties: {e}")
+        return "skipped", False, False
+
+    _log(f"\n📋 Processing: '{task_title}'")
+    _log(f"   📅 Year: {year}, Week: {week_text}, Month: {month_text}")
+
+    # Check which relations are already set
+    needs_weekly = not _has_existing_relation(properties, TASK_PROP_WEEKLY_LINK)
+    needs_monthly = not _has_existing_relation(properties, TASK_PROP_MONTHLY_LINK)
+
+    if not needs_weekly and not needs_monthly:
+        _log(f"  ⏩ Already fully linked, skipping")
+        return "skipped", False, False
+
+    # Find pages only for the missing relations (auto-creates if not found).
+    # The two lookups are independent, so they run concurrently.
+    weekly_future = (_lookup_executor.submit(_find_locked, "weekly", find_weekly_page, week_text, year)
+                     if needs_weekly else None)
+    monthly_future = (_lookup_executor.submit(_find_locked, "monthly", find_monthly_page, month_text, year)
+                      if needs_monthly else None)
+    weekly_page_id, weekly_was_created = _collect_lookup(weekly_future)
+    monthly_page_id, monthly_was_created = _collect_lookup(monthly_future)
+
+    # If we couldn't find or create the target pages, skip
+    if needs_weekly and not weekly_page_id:
+        _log(f"  ⚠️ Cannot link weekly — page not found or created")
+    if needs_monthly and not monthly_page_id:
+        _log(f"  ⚠️ Cannot link monthly — page not found or created")
+
+    if not weekly_page_id and not monthly_page_id:
+        _log(f"  ⏩ No matching pages found, skipping")
+        return "skipped", weekly_was_created, monthly_was_created
+
+    # Update task
+    success = update_task_relations(task_id, weekly_page_id, monthly_page_id)
+    return ("linked" if success else "failed"), weekly_was_created, monthly_was_created
+
+
+def _run_task(task):
+    """Run process_task on a worker thread and print its log as one block."""
+    _log_state.buffer = []
+    try:
+        return process_task(task)
+    finally:
+        lines, _log_state.buffer = _log_state.buffer, None
+        with _print_lock:
+            print("\n".join(lines))
+
+
+def main():
+    """Two-phase sync: backfill all gaps, then incremental recent tasks.
+
+    Tasks are handed to the worker pool as each page of query results
+    arrives, so processing overlaps with fetching the remaining pages.
+    """
+    print(f"🗓️  Using Year-aware matching\n")
+
+    # Counters
+    outcomes = {"linked": 0, "skipped": 0, "failed": 0}
+    created_weekly = 0
+    created_monthly = 0
+    total = 0
+    prefetched_years = set()
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = []
+        for task in iter_unique_tasks():
+            total += 1
+            # Load a year's Weekly/Monthly pages before its first task is queued
+            year = extract_task_properties(task.get("properties", {}))[0]
+            if year is not None and year not in prefetched_years:
+                prefetched_years.add(year)
+                prefetch_progress_pages({year})
+            futures.append(executor.submit(_run_task, task))
+
+        for future in futures:
+            outcome, weekly_was_created, monthly_was_created = future.result()
+            outcomes[outcome] += 1
+            if weekly_was_created:
+                created_weekly += 1
+            if monthly_was_created:
+                created_monthly += 1
+
+    if not total:
+        print("✅ No tasks to process. Everything is in sync!")
+        return
+
+    linked = outcomes["linked"]
+    skipped = outcomes["skipped"]
+    failed = outcomes["failed"]
 
     # Summary
     print("\n" + "═" * 45)
     print(f"✨ Sync Complete!")
+    print(f"   📋 Tasks:    {total}")
     print(f"   ✅ Linked:   {linked}")
     print(f"   🆕 Created:  {created_weekly} weekly, {created_monthly} monthly pages")
     print(f"   ⏩ Skipped:  {skipped}")